@@ -1,42 +1,58 @@
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+import errno
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 import os
 import re  # Added for splitting ingredients
 import sys
 
-def process_ingredients(s):
+# Splits on commas, ' and ', or parentheses
+INGREDIENT_SPLIT_PATTERN = re.compile(r'\s*,\s*|\s+and\s+|\s*[\(\)]\s*')
+
+def process_ingredients(ingredients):
     """
-    Converts an ingredient string into a cleaned list of ingredients.
+    Converts a Series of ingredient strings into a long-form Series with one
+    cleaned ingredient per row (index repeated for each ingredient of a row).
     - Lowercases
     - Splits on commas, ' and ', or parentheses
-    - Returns an empty list if no data
+    - Rows with no data produce no ingredients
     """
-    if not isinstance(s, str) or not s:
-        return []
-    
-    # Lowercase and split on commas, ' and ', or parentheses
-    s_low = s.lower()
-    items = re.split(r'\s*,\s*|\s+and\s+|\s*[\(\)]\s*', s_low)
+    # Lowercase and split the whole column at once using pandas' string methods
+    split_items = ingredients.fillna('').str.lower().str.split(INGREDIENT_SPLIT_PATTERN)
     
-    # Return list, stripping whitespace and removing empty strings
-    return [item.strip() for item in items if item.strip()]
+    # One row per ingredient, stripping whitespace and removing empty strings
+    items = split_items.explode().str.strip()
+    return items[items.notna() & (items != '')]
 
-def create_nutrition_csvs_final(folder_path, output_path):
+def create_nutrition_csvs_final(folder_path, output_path, output_format='parquet'):
     """
     Loads USDA food database CSVs from a specified folder and processes them
-    into two summary CSVs.
+    into two summary tables, plus an ingredients table. Tables are written as
+    Snappy-compressed Parquet by default, or as CSV.
     
     This version:
     - Includes ALL foods of valid types.
     - Removes nutrient columns with > 50% missing data.
     - Adds the food's category.
     - If 'branded_food.csv' is found, it adds brand/owner to the
-      description and adds an 'ingredients' column as a list.
+      description and writes 'foods_ingredients' with one row per
+      (fdc_id, ingredient).
     
     Args:
         folder_path: Path to folder containing input CSV files
         output_path: Path to output directory
+        output_format: 'parquet' (default) or 'csv'
     """
     
+    if output_format not in ('parquet', 'csv'):
+        raise ValueError(f"output_format must be 'parquet' or 'csv', got {output_format!r}")
+    
     # Create output directory if it doesn't exist
     os.makedirs(output_path, exist_ok=True)
     
@@ -51,6 +67,58 @@ def create_nutrition_csvs_final(folder_path, output_path):
         'MG': 0.001,  # Milligrams to Grams
         'UG': 1e-6,   # Micrograms to Grams
     }
+
+    # Columns (and their dtypes) to load from each input file. Only the
+    # columns used below are read, so pandas doesn't have to infer types.
+    # Ids are nullable ('Int32') so a blank id doesn't fail the whole load.
+    FOOD_DTYPES = {'fdc_id': 'Int32', 'data_type': 'category', 'description': 'string', 'food_category_id': 'string'}
+    NUTRIENT_DTYPES = {'id': 'Int32', 'name': 'string', 'unit_name': 'string'}
+    # Streamed through pyarrow, whose integer columns are always nullable
+    FOOD_NUTRIENT_DTYPES = {'fdc_id': 'int32', 'nutrient_id': 'int32', 'amount': 'float64'}
+    PORTION_DTYPES = {
+        'fdc_id': 'Int32', 'amount': 'float64', 'measure_unit_id': 'Int32',
+        'portion_description': 'string', 'gram_weight': 'float64',
+    }
+    MEASURE_UNIT_DTYPES = {'id': 'Int32', 'name': 'string'}
+    CATEGORY_DTYPES = {'id': 'Int32', 'description': 'string'}
+    BRANDED_DTYPES = {'fdc_id': 'Int32', 'brand_owner': 'category', 'brand_name': 'category', 'ingredients': 'string'}
+
+    # Number of servings scaled and written to 'foods_per_serving' at a time.
+    SERVING_CHUNK_SIZE = 100_000
+
+    # Size of the blocks 'food_nutrient.csv' (by far the largest file) is streamed in.
+    FOOD_NUTRIENT_BLOCK_BYTES = 64 * 1024 * 1024
+
+    # Worker threads used to convert 'food_nutrient.csv' blocks in parallel.
+    FOOD_NUTRIENT_WORKERS = os.cpu_count() or 1
+
+    def read_input_csv(file_name, dtypes):
+        return pd.read_csv(os.path.join(folder_path, file_name), usecols=list(dtypes), dtype=dtypes, engine='pyarrow', dtype_backend='pyarrow')
+
+    def open_input_csv_stream(file_name, dtypes, block_size):
+        path = os.path.join(folder_path, file_name)
+        try:
+            return pa_csv.open_csv(
+                path,
+                read_options=pa_csv.ReadOptions(block_size=block_size),
+                convert_options=pa_csv.ConvertOptions(
+                    include_columns=list(dtypes),
+                    column_types={col: pa.from_numpy_dtype(np.dtype(dtype)) for col, dtype in dtypes.items()}
+                )
+            )
+        except FileNotFoundError as e:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path) from e
+
+    def output_file_path(table_name):
+        return os.path.join(output_path, f"{table_name}.{output_format}")
+
+    def write_output(df, table_name):
+        path = output_file_path(table_name)
+        if output_format == 'parquet':
+            df.to_parquet(path, compression='snappy', index=False)
+        else:
+            df.to_csv(path, index=False, float_format='%.4f')
+        return path
     
     # --- 1. Load Data ---
     
@@ -58,16 +126,19 @@ def create_nutrition_csvs_final(folder_path, output_path):
     
     try:
         # All file paths now use os.path.join to read from the provided folder_path
-        df_food = pd.read_csv(os.path.join(folder_path, "food.csv"), low_memory=False)
-        df_nutrient = pd.read_csv(os.path.join(folder_path, "nutrient.csv"), low_memory=False)
-        df_food_nutrient = pd.read_csv(os.path.join(folder_path, "food_nutrient.csv"), low_memory=False)
-        df_portion = pd.read_csv(os.path.join(folder_path, "food_portion.csv"), low_memory=False)
-        df_measure_unit = pd.read_csv(os.path.join(folder_path, "measure_unit.csv"), low_memory=False)
-        df_category = pd.read_csv(os.path.join(folder_path, "food_category.csv"), low_memory=False)
+        df_food = read_input_csv("food.csv", FOOD_DTYPES)
+        df_nutrient = read_input_csv("nutrient.csv", NUTRIENT_DTYPES)
+        # food_nutrient.csv is streamed block by block below; only check it's there
+        food_nutrient_path = os.path.join(folder_path, "food_nutrient.csv")
+        if not os.path.isfile(food_nutrient_path):
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), food_nutrient_path)
+        df_portion = read_input_csv("food_portion.csv", PORTION_DTYPES)
+        df_measure_unit = read_input_csv("measure_unit.csv", MEASURE_UNIT_DTYPES)
+        df_category = read_input_csv("food_category.csv", CATEGORY_DTYPES)
         
         # --- Attempt to load branded_food.csv ---
         try:
-            df_branded = pd.read_csv(os.path.join(folder_path, "branded_food.csv"), low_memory=False)
+            df_branded = read_input_csv("branded_food.csv", BRANDED_DTYPES)
             print("Successfully loaded branded_food.csv.")
         except FileNotFoundError:
             df_branded = None
@@ -78,6 +149,15 @@ def create_nutrition_csvs_final(folder_path, output_path):
         print(f"Please make sure all CSV files (food.csv, nutrient.csv, etc.) are in the directory: {folder_path}")
         return
 
+    # Rows without an id can't be joined to anything, so drop them
+    df_food = df_food.dropna(subset=['fdc_id'])
+    df_nutrient = df_nutrient.dropna(subset=['id'])
+    df_portion = df_portion.dropna(subset=['fdc_id'])
+    df_measure_unit = df_measure_unit.dropna(subset=['id'])
+    df_category = df_category.dropna(subset=['id'])
+    if df_branded is not None:
+        df_branded = df_branded.dropna(subset=['fdc_id'])
+
     print("Data loading complete.")
 
     # --- 2. Prepare Nutrient Mappings ---
@@ -85,14 +165,23 @@ def create_nutrition_csvs_final(folder_path, output_path):
     print("Preparing nutrient mappings and unit conversions...")
 
     df_nutrient['conversion_factor'] = df_nutrient['unit_name'].map(UNIT_TO_GRAM_FACTOR).fillna(1.0)
-    df_nutrient['final_unit'] = df_nutrient['unit_name'].apply(lambda x: 'G' if x in UNIT_TO_GRAM_FACTOR else x)
+    df_nutrient['final_unit'] = df_nutrient['unit_name'].mask(
+        df_nutrient['unit_name'].isin(list(UNIT_TO_GRAM_FACTOR)), 'G'
+    )
     df_nutrient['column_name'] = df_nutrient['name'] + ' (' + df_nutrient['final_unit'] + ')'
 
-    id_to_column = df_nutrient.set_index('id')['column_name'].to_dict()
-    id_to_converter = df_nutrient.set_index('id')['conversion_factor'].to_dict()
-
     all_nutrient_columns = sorted(list(df_nutrient['column_name'].unique()))
 
+    # Nutrient ids are small integers, so map them with lookup arrays indexed by
+    # id rather than dicts. Columns are mapped to their position in
+    # all_nutrient_columns. The extra last slot is for ids not in nutrient.csv.
+    nutrient_ids = df_nutrient['id'].to_numpy(dtype=np.int64)
+    unknown_nutrient_slot = int(nutrient_ids.max()) + 1
+    id_to_converter = np.full(unknown_nutrient_slot + 1, np.nan)
+    id_to_converter[nutrient_ids] = df_nutrient['conversion_factor'].to_numpy(dtype=np.float64)
+    id_to_column_code = np.full(unknown_nutrient_slot + 1, -1, dtype=np.int64)
+    id_to_column_code[nutrient_ids] = pd.Index(all_nutrient_columns).get_indexer(df_nutrient['column_name'])
+
     # --- 3. Filter and Process Food Data ---
 
     print("Filtering and standardizing food data...")
@@ -103,149 +192,207 @@ def create_nutrition_csvs_final(folder_path, output_path):
     
     # Add Category Information
     print("Adding food category descriptions...")
-    df_category = df_category.rename(columns={'description': 'category'})
+    df_category = df_category.rename(columns={'description': 'category'}).set_index('id')
     
     # --- ERROR FIX HERE ---
-    df_food_filtered['food_category_id'] = pd.to_numeric(
-        df_food_filtered['food_category_id'], errors='coerce'
-    )
+    # Non-numeric and fractional ids become <NA> (rather than being truncated);
+    # a nullable int matches the integer category ids
+    food_category_id = pd.to_numeric(df_food_filtered['food_category_id'], errors='coerce')
+    df_food_filtered['food_category_id'] = food_category_id.where(
+        food_category_id == food_category_id.round()
+    ).astype('Int32')
     # --- END FIX ---
 
-    df_food_filtered = df_food_filtered.merge(
-        df_category[['id', 'category']],
-        left_on='food_category_id',
-        right_on='id',
-        how='left'
-    )
-    df_food_filtered['category'] = df_food_filtered['category'].fillna('Unknown')
+    # Look categories up on the id-indexed table instead of merging
+    df_food_filtered['category'] = df_food_filtered['food_category_id'].map(df_category['category'])
+    # Few distinct categories across many foods, so keep it as a categorical
+    df_food_filtered['category'] = df_food_filtered['category'].fillna('Unknown').astype('category')
     
     # --- Add Brand and Ingredient Information ---
     if df_branded is not None:
         print("Adding brand and ingredient data...")
         # Select relevant columns
         # --- FIX: Add .copy() to prevent SettingWithCopyWarning ---
-        df_brand_info = df_branded[['fdc_id', 'brand_owner', 'brand_name', 'ingredients']].copy()
+        df_brand_info = df_branded[['fdc_id', 'brand_owner', 'brand_name']].copy()
         
-        # --- NEW: Process ingredients into a list ---
-        df_brand_info['ingredients'] = df_brand_info['ingredients'].apply(process_ingredients)
-        # --- END NEW ---
+        # Process ingredients into a long-form (fdc_id, ingredient) table
+        df_ingredients = df_branded[['fdc_id']].join(
+            process_ingredients(df_branded['ingredients']).rename('ingredient'),
+            how='inner'
+        )
         
-        # Clean up brand text data
-        df_brand_info['brand_owner'] = df_brand_info['brand_owner'].fillna('')
-        df_brand_info['brand_name'] = df_brand_info['brand_name'].fillna('')
-
-        # Create brand prefix
-        def create_brand_prefix(row):
-            if row['brand_name'] and row['brand_name'] != row['brand_owner']:
-                return f"{row['brand_owner']} - {row['brand_name']}: "
-            elif row['brand_owner']:
-                return f"{row['brand_owner']}: "
-            else:
-                return ""
+        # Brand owner/name are categoricals with few distinct values, so build the
+        # prefix once per distinct (owner, name) pair and merge it back on the codes
+        df_brand_pairs = df_brand_info[['brand_owner', 'brand_name']].drop_duplicates()
         
-        df_brand_info['brand_prefix'] = df_brand_info.apply(create_brand_prefix, axis=1)
+        # Clean up brand text data
+        brand_owner = df_brand_pairs['brand_owner'].astype('string').fillna('')
+        brand_name = df_brand_pairs['brand_name'].astype('string').fillna('')
+
+        # Create brand prefix: "owner - name: " if the brand name adds anything,
+        # else "owner: ", else nothing
+        has_distinct_name = (brand_name != '') & (brand_name != brand_owner)
+        owner_prefix = (brand_owner + ': ').where(brand_owner != '', '')
+        df_brand_pairs['brand_prefix'] = (brand_owner + ' - ' + brand_name + ': ').where(
+            has_distinct_name, owner_prefix
+        )
+        df_brand_info = df_brand_info.merge(df_brand_pairs, on=['brand_owner', 'brand_name'], how='left')
         
         # Merge brand info into the main food dataframe
         df_food_filtered = df_food_filtered.merge(
-            df_brand_info[['fdc_id', 'brand_prefix', 'ingredients']],
+            df_brand_info[['fdc_id', 'brand_prefix']],
             on='fdc_id',
             how='left'
         )
         
-        # Fill missing brand/ingredients for non-branded foods
+        # Fill missing brand for non-branded foods
         df_food_filtered['brand_prefix'] = df_food_filtered['brand_prefix'].fillna('')
         
-        # --- NEW: Fill missing ingredients with an empty list ---
-        df_food_filtered['ingredients'] = df_food_filtered['ingredients'].apply(
-            lambda x: x if isinstance(x, list) else []
-        )
-        # --- END NEW ---
-        
         # Prepend brand to description
         df_food_filtered['description'] = df_food_filtered['brand_prefix'] + df_food_filtered['description']
         
     else:
-        # If branded_food.csv wasn't loaded, create empty ingredients column
-        # --- NEW: Ensure it's an empty list for type consistency ---
-        df_food_filtered['ingredients'] = [[] for _ in range(len(df_food_filtered))]
-        # --- END NEW ---
+        # If branded_food.csv wasn't loaded, there are no ingredients
+        df_ingredients = pd.DataFrame({'fdc_id': pd.Series(dtype='Int32'), 'ingredient': pd.Series(dtype='string')})
     
-    all_valid_fdc_ids = set(df_food_filtered['fdc_id'])
+    # A unique pd.Index (rather than a Python set) lets the lookups below use
+    # pandas' hash table instead of hashing every row against Python objects
+    all_valid_fdc_ids = pd.Index(df_food_filtered['fdc_id'].unique())
     
-    if not all_valid_fdc_ids:
+    if all_valid_fdc_ids.empty:
         print(f"Error: No foods found for the valid types: {VALID_FOOD_TYPES}")
         return
         
     print(f"Found {len(all_valid_fdc_ids)} foods of valid types.")
 
-    df_fn_filtered = df_food_nutrient[df_food_nutrient['fdc_id'].isin(all_valid_fdc_ids)].copy()
-    converters = df_fn_filtered['nutrient_id'].map(id_to_converter)
-    df_fn_filtered['amount_std'] = df_fn_filtered['amount'] * converters
-
     # --- 4. Prepare Data for Pivoting ---
 
     print(f"Preparing data for all {len(all_valid_fdc_ids)} valid foods.")
 
-    df_fn_filtered['column_name'] = df_fn_filtered['nutrient_id'].map(id_to_column)
-    df_fn_pivot_ready = df_fn_filtered[['fdc_id', 'column_name', 'amount_std']]
-    df_fn_pivot_ready = df_fn_pivot_ready.drop_duplicates(subset=['fdc_id', 'column_name'])
+    # Amounts are scattered straight into a dense (food x nutrient) matrix instead
+    # of using df.pivot, which builds hash tables and a MultiIndex along the way.
+    # Rows follow all_valid_fdc_ids; foods that never show up in food_nutrient.csv
+    # are dropped once all blocks have been read. For duplicate (food, nutrient)
+    # rows the last non-missing amount in the file wins.
+    wide_values = np.full((len(all_valid_fdc_ids), len(all_nutrient_columns)), -1.0, dtype=np.float32)
+    has_nutrient_data = np.zeros(len(all_valid_fdc_ids), dtype=bool)
+
+    def prepare_food_nutrient_block(fn_block):
+        """Filters and converts one block; returns the codes/amounts to scatter."""
+        df_fn_block = fn_block.to_pandas()
+        fdc_codes = all_valid_fdc_ids.get_indexer(df_fn_block['fdc_id'])
+        df_fn_filtered = df_fn_block[fdc_codes != -1].copy()
+        df_fn_filtered['fdc_code'] = fdc_codes[fdc_codes != -1]
+        
+        # A block with a blank nutrient_id comes back as float64; blanks go to the sentinel
+        nutrient_slots = df_fn_filtered['nutrient_id'].fillna(-1).to_numpy(dtype=np.int64)
+        nutrient_slots = np.where(
+            (nutrient_slots >= 0) & (nutrient_slots < unknown_nutrient_slot), nutrient_slots, unknown_nutrient_slot
+        )
+        df_fn_filtered['amount_std'] = df_fn_filtered['amount'] * id_to_converter[nutrient_slots]
+        # float32 is plenty for nutrient amounts (written with 4 decimals) and halves
+        # the memory of everything downstream of here
+        df_fn_filtered['amount_std'] = df_fn_filtered['amount_std'].astype('float32')
+        df_fn_filtered['column_code'] = id_to_column_code[nutrient_slots]
+
+        df_fn_pivot_ready = df_fn_filtered[['fdc_code', 'column_code', 'amount_std']]
+        # Missing amounts are left as -1 in the matrix, so they can't overwrite a
+        # valid amount given elsewhere for the same cell
+        df_fn_pivot_ready = df_fn_pivot_ready[
+            (df_fn_pivot_ready['column_code'] != -1) & df_fn_pivot_ready['amount_std'].notna()
+        ]
+        row_codes = df_fn_pivot_ready['fdc_code'].to_numpy()
+        col_codes = df_fn_pivot_ready['column_code'].to_numpy()
+        
+        # NumPy doesn't specify which value lands when a fancy assignment repeats a
+        # cell, so keep only the last row per cell (a hash lookup, no sort)
+        cell_index = row_codes.astype(np.int64) * len(all_nutrient_columns) + col_codes
+        keep = ~pd.Index(cell_index).duplicated(keep='last')
+        
+        return (
+            df_fn_filtered['fdc_code'].to_numpy(),
+            row_codes[keep],
+            col_codes[keep],
+            df_fn_pivot_ready['amount_std'].to_numpy()[keep]
+        )
+
+    def scatter_food_nutrient_block(prepared_block):
+        """Writes one prepared block into the matrix. Only called from the main thread."""
+        fdc_codes, row_codes, col_codes, amounts = prepared_block
+        has_nutrient_data[fdc_codes] = True
+        wide_values[row_codes, col_codes] = amounts
 
     # --- 5. Create Wide Data & Filter Sparse Columns ---
 
     print("Pivoting data and filling missing values...")
 
-    df_wide = df_fn_pivot_ready.pivot(
-        index='fdc_id',
-        columns='column_name',
-        values='amount_std'
+    # Blocks are prepared in worker threads (the pandas/NumPy work mostly releases
+    # the GIL) and scattered in file order, so later blocks overwrite earlier ones
+    # and the last value in the file wins. Only a few blocks are kept in flight to
+    # bound memory.
+    with open_input_csv_stream(
+        "food_nutrient.csv", FOOD_NUTRIENT_DTYPES, FOOD_NUTRIENT_BLOCK_BYTES
+    ) as food_nutrient_reader, ThreadPoolExecutor(max_workers=FOOD_NUTRIENT_WORKERS) as executor:
+        pending_blocks = deque()
+        for food_nutrient_block in food_nutrient_reader:
+            pending_blocks.append(executor.submit(prepare_food_nutrient_block, food_nutrient_block))
+            if len(pending_blocks) > FOOD_NUTRIENT_WORKERS:
+                scatter_food_nutrient_block(pending_blocks.popleft().result())
+        while pending_blocks:
+            scatter_food_nutrient_block(pending_blocks.popleft().result())
+
+    wide_values = wide_values[has_nutrient_data]
+
+    df_wide_all_cols = pd.DataFrame(
+        wide_values,
+        index=pd.Index(all_valid_fdc_ids[has_nutrient_data], name='fdc_id'),
+        columns=pd.Index(all_nutrient_columns, name='column_name')
     )
-
-    df_wide_all_cols = df_wide.reindex(columns=all_nutrient_columns, fill_value=-1.0)
-    df_wide_all_cols = df_wide_all_cols.fillna(-1.0)
     
     print("Checking for sparsely populated nutrient columns...")
     total_foods = len(df_wide_all_cols)
     threshold = total_foods / 2.0
-    columns_to_drop = []
     
-    for col in all_nutrient_columns:
-        missing_count = (df_wide_all_cols[col] == -1.0).sum()
-        if missing_count > threshold:
-            columns_to_drop.append(col)
-            
-    if columns_to_drop:
-        print(f"Dropping {len(columns_to_drop)} columns with > 50% missing data.")
-        df_wide_filtered = df_wide_all_cols.drop(columns=columns_to_drop)
-        final_nutrient_columns = [col for col in all_nutrient_columns if col not in columns_to_drop]
+    # Count missing (-1) values in every column with a single pass over the matrix
+    missing_counts = (df_wide_all_cols.to_numpy() == -1.0).sum(axis=0)
+    keep_columns = missing_counts <= threshold
+    
+    if not keep_columns.all():
+        print(f"Dropping {int((~keep_columns).sum())} columns with > 50% missing data.")
+        df_wide_filtered = df_wide_all_cols.loc[:, keep_columns]
     else:
         print("No sparse columns found. Keeping all nutrients.")
         df_wide_filtered = df_wide_all_cols
-        final_nutrient_columns = all_nutrient_columns
+    final_nutrient_columns = df_wide_filtered.columns.tolist()
 
     print(f"Kept {len(final_nutrient_columns)} nutrient columns.")
     
-    # --- 6. Create 'foods_per_100g.csv' ---
+    # --- 6. Create 'foods_per_100g' ---
 
-    print("Creating 'foods_per_100g.csv'...")
+    print("Creating 'foods_per_100g'...")
     
-    # Join with the food descriptions - ADDED 'category' and 'ingredients'
-    df_100g = df_food_filtered[['fdc_id', 'description', 'category', 'ingredients']].merge(
+    # Join with the food descriptions - ADDED 'category'
+    df_100g = df_food_filtered[['fdc_id', 'description', 'category']].merge(
         df_wide_filtered,  # Use the filtered DataFrame
         on='fdc_id'
     )
     
     df_100g['fdc_id'] = df_100g['fdc_id'].astype(int)
-    # Re-order columns to put category and ingredients up front
-    cols_100g = ['fdc_id', 'description', 'category', 'ingredients'] + final_nutrient_columns
+    # Re-order columns to put category up front
+    cols_100g = ['fdc_id', 'description', 'category'] + final_nutrient_columns
     df_100g = df_100g[cols_100g]
-    df_100g = df_100g.sort_values(by='description').reset_index(drop=True)
+    df_100g = df_100g.sort_values(by='description', kind='stable').reset_index(drop=True)
 
-    # Save the per-100g CSV
-    output_100g_path = os.path.join(output_path, "foods_per_100g.csv")
-    df_100g.to_csv(output_100g_path, index=False, float_format='%.4f')
+    # Save the per-100g table
+    output_100g_path = write_output(df_100g, "foods_per_100g")
     print(f"Successfully created '{output_100g_path}' with {len(df_100g)} foods.")
 
-    # --- 7. Create 'foods_per_serving.csv' ---
+    # Save the ingredients table, limited to the foods in the per-100g table
+    df_ingredients = df_ingredients[df_ingredients['fdc_id'].isin(df_wide_filtered.index)]
+    output_ingredients_path = write_output(df_ingredients, "foods_ingredients")
+    print(f"Successfully created '{output_ingredients_path}' with {len(df_ingredients)} food/ingredient pairs.")
+
+    # --- 7. Create 'foods_per_serving' ---
 
     print("Processing serving data...")
 
@@ -256,16 +403,19 @@ def create_nutrition_csvs_final(folder_path, output_path):
     ]
     
     if df_portion_filtered.empty:
-        print("Warning: No valid portion data found for the filtered foods. Skipping 'foods_per_serving.csv'.")
+        print("Warning: No valid portion data found for the filtered foods. Skipping 'foods_per_serving'.")
         print("\nAll done!")
         return
 
     df_portion_full = df_portion_filtered.merge(df_measure_unit, left_on='measure_unit_id', right_on='id', suffixes=('_portion', '_unit'))
 
-    df_portion_full['serving_description'] = df_portion_full.apply(
-        lambda row: row['portion_description'] if pd.notna(row['portion_description']) and row['portion_description'].strip()
-        else f"{row['amount']} {row['name']}",
-        axis=1
+    # Use the portion description if present, otherwise "<amount> <unit name>"
+    has_description = df_portion_full['portion_description'].fillna('').str.strip() != ''
+    # Formatted like f"{amount} {name}", so a missing part reads 'nan' and never
+    # nulls out the description (which would merge distinct servings below)
+    fallback_description = df_portion_full['amount'].map(str) + ' ' + df_portion_full['name'].fillna('nan')
+    df_portion_full['serving_description'] = df_portion_full['portion_description'].where(
+        has_description, fallback_description
     )
     
     df_servings_base = df_portion_full[['fdc_id', 'serving_description', 'gram_weight']]
@@ -274,55 +424,91 @@ def create_nutrition_csvs_final(folder_path, output_path):
 
     print(f"Found {len(df_servings_base)} unique servings.")
 
-    # Join serving data with the *filtered* per-100g nutrient data
-    df_per_serving = df_servings_base.merge(
-        df_wide_filtered,  # Use the filtered DataFrame
+    # Join serving data with food descriptions - ADDED 'category'
+    # Nutrient values are looked up and scaled chunk by chunk while writing, so the
+    # full (servings x nutrients) table never has to be held in memory.
+    df_per_serving_final = df_food_filtered[['fdc_id', 'description', 'category']].merge(
+        df_servings_base,
         on='fdc_id'
     )
+    # Only keep servings of foods with (filtered) per-100g nutrient data, and
+    # remember each serving's row in the nutrient matrix
+    df_per_serving_final['nutrient_row'] = df_wide_filtered.index.get_indexer(df_per_serving_final['fdc_id'])
+    df_per_serving_final = df_per_serving_final[df_per_serving_final['nutrient_row'] != -1]
+    
+    df_per_serving_final = df_per_serving_final.sort_values(
+        by=['description', 'serving_description'], kind='stable'
+    ).reset_index(drop=True)
     
     print("Calculating per-serving nutrient values...")
 
-    # Apply scaling factor to all *remaining* nutrient columns
-    for col in final_nutrient_columns: # Use the filtered list
-        if col in df_per_serving.columns:
+    # Per-100g nutrient values (and their missing mask) are extracted once and
+    # gathered by row position for each chunk, instead of re-indexing by fdc_id
+    nutrient_base = df_wide_filtered[final_nutrient_columns].to_numpy(dtype=np.float32)
+    nutrient_missing = nutrient_base == -1.0
+    nutrient_rows = df_per_serving_final.pop('nutrient_row').to_numpy()
+
+    # Save the per-serving table, one chunk of servings at a time
+    output_serving_path = output_file_path("foods_per_serving")
+    parquet_writer = None
+    
+    # The Parquet writer is closed even if a chunk fails part way through
+    with ExitStack() as output_files:
+        # Always run at least one (possibly empty) chunk so the header (or schema) is written
+        for chunk_start in range(0, max(len(df_per_serving_final), 1), SERVING_CHUNK_SIZE):
+            chunk_slice = slice(chunk_start, chunk_start + SERVING_CHUNK_SIZE)
+            df_chunk = df_per_serving_final.iloc[chunk_slice]
+            chunk_rows = nutrient_rows[chunk_slice]
+            
+            # Apply scaling factor to all *remaining* nutrient columns in one vectorized pass
+            scale = (df_chunk['serving_size_g'].to_numpy(dtype=np.float32) / 100.0)[:, None]
             # Only scale if the value is not -1 (missing)
-            df_per_serving[col] = df_per_serving.apply(
-                lambda row: row[col] * (row['serving_size_g'] / 100.0) if row[col] != -1.0 else -1.0,
-                axis=1
+            df_chunk_nutrients = pd.DataFrame(
+                np.where(nutrient_missing[chunk_rows], -1.0, nutrient_base[chunk_rows] * scale),
+                index=df_chunk.index,
+                columns=final_nutrient_columns
             )
             
-    # Join with food descriptions - ADDED 'category' and 'ingredients'
-    df_per_serving_final = df_food_filtered[['fdc_id', 'description', 'category', 'ingredients']].merge(
-        df_per_serving,
-        on='fdc_id'
-    )
-    
-    # Re-order columns - ADDED 'category' and 'ingredients'
-    final_serving_cols = ['fdc_id', 'description', 'category', 'ingredients', 'serving_description', 'serving_size_g'] + final_nutrient_columns # Use filtered list
-    df_per_serving_final = df_per_serving_final[final_serving_cols]
-    
-    df_per_serving_final = df_per_serving_final.sort_values(by=['description', 'serving_description']).reset_index(drop=True)
-    
-    # Save the per-serving CSV
-    output_serving_path = os.path.join(output_path, "foods_per_serving.csv")
-    df_per_serving_final.to_csv(output_serving_path, index=False, float_format='%.4f')
+            df_chunk = pd.concat([df_chunk, df_chunk_nutrients], axis=1)
+            if output_format == 'parquet':
+                table = pa.Table.from_pandas(df_chunk, preserve_index=False)
+                if parquet_writer is None:
+                    parquet_writer = output_files.enter_context(
+                        pq.ParquetWriter(output_serving_path, table.schema, compression='snappy')
+                    )
+                parquet_writer.write_table(table)
+            else:
+                df_chunk.to_csv(
+                    output_serving_path,
+                    mode='w' if chunk_start == 0 else 'a',
+                    header=chunk_start == 0,
+                    index=False,
+                    float_format='%.4f'
+                )
     
     print(f"Successfully created '{output_serving_path}' with {len(df_per_serving_final)} food/serving combinations.")
     print("\nAll done!")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python csv_parse.py <input_folder> <output_folder>")
-        print("  input_folder: Path to folder containing USDA CSV files")
-        print("  output_folder: Path to output directory")
-        sys.exit(1)
-        
-    csv_folder_path = sys.argv[1]
-    output_folder_path = sys.argv[2]
+    parser = argparse.ArgumentParser(
+        description="Process USDA food database CSVs into per-100g and per-serving nutrition tables."
+    )
+    parser.add_argument("input_folder", help="Path to folder containing USDA CSV files")
+    parser.add_argument("output_folder", help="Path to output directory")
+    parser.add_argument(
+        "--format",
+        choices=["parquet", "csv"],
+        default="parquet",
+        help="Output file format (default: parquet)"
+    )
+    args = parser.parse_args()
+    
+    csv_folder_path = args.input_folder
+    output_folder_path = args.output_folder
     
     if not os.path.isdir(csv_folder_path):
         print(f"Error: Path not found or is not a directory: {csv_folder_path}")
         sys.exit(1)
         
-    create_nutrition_csvs_final(csv_folder_path, output_folder_path)
\ No newline at end of file
+    create_nutrition_csvs_final(csv_folder_path, output_folder_path, output_format=args.format)